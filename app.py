@@ -1,17 +1,19 @@
 import streamlit as st
-import FinanceDataReader as fdr
-import mplfinance as mpf
-import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import json
-from streamlit_lottie import st_lottie
+import os
+import time
+import numpy as np
 import pandas as pd
+from numba import njit
 
 st.set_page_config(page_title="🔍 주식 정보 시각화")
 
 # 시장 데이터를 읽어오는 함수 (미국 주식 호환)
 @st.cache_data(ttl=3600)
 def getData(code, datestart, dateend):
+    import FinanceDataReader as fdr  # 지연 임포트 (목록만 보는 rerun은 비용 없음)
     try:
         df = fdr.DataReader(code, datestart, dateend)
         if 'Change' in df.columns:
@@ -21,10 +23,32 @@ def getData(code, datestart, dateend):
         st.error(f"데이터를 가져올 수 없습니다: {code} ({e})")
         return None
 
-@st.cache_data
-def get_symbols(market='KOSPI', sort='Marcap'):
+# 상장 목록 디스크 캐시 (세션이 새로 떠도 재다운로드 방지, 목록은 주 단위 갱신이면 충분)
+LISTING_CACHE_DIR = './.cache'
+LISTING_CACHE_TTL = 7 * 24 * 3600
+
+def fetch_listing(market):
+    import FinanceDataReader as fdr  # 지연 임포트
+    path = os.path.join(LISTING_CACHE_DIR, f'listings_{market}.parquet')
+    try:
+        if os.path.exists(path) and time.time() - os.path.getmtime(path) < LISTING_CACHE_TTL:
+            return pd.read_parquet(path)
+    except Exception:
+        pass  # 캐시 파일이 깨졌으면 새로 받는다
+    df = fdr.StockListing(market)
+    try:
+        os.makedirs(LISTING_CACHE_DIR, exist_ok=True)
+        df.to_parquet(path)
+    except Exception:
+        pass  # parquet 저장 실패는 무시 (다음 세션에서 다시 받음)
+    return df
+
+# 목록은 모든 세션이 동일한 불변 DataFrame을 공유 → cache_resource로 복사/직렬화 생략
+# (호출부는 sort_values 등 새 프레임을 만드는 연산만 사용할 것)
+@st.cache_resource(ttl=86400)
+def get_symbols(market='KOSPI'):
     try:
-        df = fdr.StockListing(market)
+        df = fetch_listing(market)
         
         # 컬럼명 통일 (미국 시장 호환)
         rename_rules = {
@@ -34,16 +58,19 @@ def get_symbols(market='KOSPI', sort='Marcap'):
         }
         df = df.rename(columns=rename_rules)
         
-        # 숫자 컬럼을 안전하게 숫자로 변환
+        # 숫자 컬럼을 안전하게 숫자로 변환 (이미 숫자 dtype이면 변환 패스 생략)
         for col in ['Close', 'Marcap']:
-            if col in df.columns:
+            if col in df.columns and not pd.api.types.is_numeric_dtype(df[col]):
                 df[col] = pd.to_numeric(df[col], errors='coerce')
         
-        # 정렬
-        actual_sort = sort if sort in df.columns else 'Code'
-        ascending = False if actual_sort == 'Marcap' else True
-        df = df.sort_values(by=actual_sort, ascending=ascending)
-        
+        # 표시에 쓰는 컬럼만 캐시 (섹터/상장일 등 미사용 컬럼 제외로 메모리 절감)
+        keep = [c for c in ('Code', 'Name', 'Close', 'Marcap', 'Market') if c in df.columns]
+        df = df[keep].copy()
+        # Market은 저카디널리티 → category로 축소 (Code/Name은 사실상 유니크라 제외)
+        if 'Market' in df.columns:
+            df['Market'] = df['Market'].astype('category')
+
+        # 정렬은 호출부에서 한 번만 수행 (캐시 키/저장 데이터를 시장 단위로 유지)
         return df
     except Exception as e:
         st.error(f"주식 목록을 가져올 수 없습니다: {e}")
@@ -58,6 +85,8 @@ def load_lottie_local(filepath):
         return None
 
 def render_header():
+    from streamlit_lottie import st_lottie  # 지연 임포트
+
     col1, col2, col3 = st.columns([1, 4, 1], vertical_alignment="center")
     with col1:
         lottie_path = "./resources/header_logo.json"
@@ -70,78 +99,196 @@ def render_header():
         st.markdown("<h1 style='text-align: center;'>🔍 주식 정보 시각화</h1>", unsafe_allow_html=True)
     with col3:
         if st.button("🔄", use_container_width=True):
-            # 모든 상태 초기화
-            for key in list(st.session_state.keys()):
-                del st.session_state[key]
+            # 모든 상태 초기화 (키별 del 루프 대신 일괄 clear)
+            st.session_state.clear()
             st.rerun()
 
-def chart(chart_code, ndays, chart_style, volume, show_bb, show_rsi, show_macd):
-    code = chart_code.strip().upper()
-    date_end = datetime.today().date()
-    date_start = (date_end - timedelta(days=ndays + 50))
-    
+# Wilder RSI: 재귀식(EMA α=1/14)이라 완전 벡터화 불가 → numba로 컴파일
+# 최초 호출의 컴파일 비용은 compute_indicators 캐시가 흡수
+@njit(cache=True)
+def wilder_rsi(close, n=14):
+    out = np.full(close.size, np.nan)
+    if close.size <= n:
+        return out
+    delta = np.diff(close)
+    gain = np.where(delta > 0.0, delta, 0.0)
+    loss = np.where(delta < 0.0, -delta, 0.0)
+    avg_gain = gain[:n].mean()
+    avg_loss = loss[:n].mean()
+    for i in range(n, close.size):
+        if i > n:
+            avg_gain = (avg_gain * (n - 1) + gain[i - 1]) / n
+            avg_loss = (avg_loss * (n - 1) + loss[i - 1]) / n
+        if avg_loss == 0.0:
+            out[i] = 100.0
+        else:
+            out[i] = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    return out
+
+# 지표 계산을 별도로 캐시 (체크박스/스타일 변경 시 pandas 재계산 방지)
+@st.cache_data(ttl=3600)
+def compute_indicators(code, date_start, date_end):
+    from scipy.signal import lfilter  # 지연 임포트
+
     df = getData(code, date_start, date_end)
     if df is None or df.empty:
-        st.error(f"📉 '{code}' 데이터 오류")
-        return
+        return None
 
     # --- [지표 계산] ---
-    df['MA20'] = df['Close'].rolling(window=20).mean()
-    df['std'] = df['Close'].rolling(window=20).std()
+    close = df['Close'].to_numpy(dtype=np.float64)
+
+    # MA20/볼린저: sliding_window_view 한 번으로 같은 윈도우에서 mean과 std를 계산
+    pad = np.full(min(19, close.size), np.nan)
+    if close.size >= 20:
+        windows = np.lib.stride_tricks.sliding_window_view(close, 20)
+        mu = np.concatenate([pad, windows.mean(axis=-1)])
+        sd = np.concatenate([pad, windows.std(axis=-1, ddof=1)])
+    else:
+        mu = sd = pad
+    df['MA20'] = mu
+    df['std'] = sd
     df['BB_Upper'] = df['MA20'] + (df['std'] * 2)
     df['BB_Lower'] = df['MA20'] - (df['std'] * 2)
 
-    delta = df['Close'].diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-    df['RSI'] = 100 - (100 / (1 + (gain / loss)))
+    # 이동평균선 (5/10/30) — mpf의 mav 옵션 대신 직접 계산
+    for window in (5, 10, 30):
+        ma = np.convolve(close, np.ones(window) / window, mode='full')[:close.size]
+        ma[:window - 1] = np.nan
+        df[f'MA{window}'] = ma
+
+    # RSI (Wilder 방식, numba 컴파일 루프)
+    df['RSI'] = wilder_rsi(close)
+
+    # MACD: pandas ewm 대신 lfilter로 EMA 계산 (raw 배열 단일 패스, ewm(adjust=False)과 동일)
+    def ema(x, span):
+        a = 2.0 / (span + 1)
+        return lfilter([a], [1.0, -(1.0 - a)], x, zi=[(1.0 - a) * x[0]])[0]
+    macd = ema(close, 12) - ema(close, 26)
+    signal = ema(macd, 9)
+    df['MACD'] = macd
+    df['Signal'] = signal
+    df['Hist'] = macd - signal
+
+    return df
+
+# 목록 상위 종목 시세를 백그라운드로 미리 받아 getData 캐시 워밍업 (첫 클릭 즉시 응답)
+def prefetch_charts(df, top_n=20):
+    ndays = st.session_state.ndays
+    date_end = datetime.today().date()
+    date_start = date_end - timedelta(days=ndays + INDICATOR_WARMUP_DAYS)  # chart()와 동일한 키로 조회해야 캐시 적중
+    codes = [str(c).strip().upper() for c in df['Code'].head(top_n)]
+    executor = ThreadPoolExecutor(max_workers=8)
+    for code in codes:
+        executor.submit(getData, code, date_start, date_end)
+    executor.shutdown(wait=False)  # 사용자 think-time 동안 백그라운드로 진행
+
+# 기존 mpf 스타일 옵션을 plotly 템플릿으로 매핑
+PLOTLY_TEMPLATES = {
+    'default': 'plotly',
+    'binance': 'plotly_dark',
+    'classic': 'simple_white',
+    'yahoo': 'plotly_white',
+    'charles': 'seaborn',
+}
+
+# 지표 워밍업 패딩(달력일): 표시 구간은 거래일 행 기준(iloc[-ndays:])이므로
+# 가장 긴 윈도우(MA30)의 선행 29행 ≈ 29×7/5 ≈ 41일에 휴장일 여유분을 더한 값.
+# 필요한 선행 행 수는 ndays와 무관하게 동일하다.
+INDICATOR_WARMUP_DAYS = 48
+
+def chart(chart_code, ndays, chart_style, volume, show_bb, show_rsi, show_macd):
+    code = chart_code.strip().upper()
+    date_end = datetime.today().date()
+    date_start = (date_end - timedelta(days=ndays + INDICATOR_WARMUP_DAYS))
+
+    # 동일 설정 재요청이면 Figure를 새로 만들지 않고 기존 렌더링 결과 재사용
+    render_key = (code, ndays, chart_style, volume, show_bb, show_rsi, show_macd, date_end)
+    if st.session_state.get('chart_fig') is not None and st.session_state.get('render_key') == render_key:
+        return
+
+    # 무거운 플로팅 스택은 실제 차트를 새로 그릴 때만 임포트
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    from plotly_resampler import FigureResampler
+
+    df = compute_indicators(code, date_start, date_end)
+    if df is None or df.empty:
+        st.error(f"📉 '{code}' 데이터 오류")
+        return
 
-    exp1 = df['Close'].ewm(span=12, adjust=False).mean()
-    exp2 = df['Close'].ewm(span=26, adjust=False).mean()
-    df['MACD'] = exp1 - exp2
-    df['Signal'] = df['MACD'].ewm(span=9, adjust=False).mean()
-    df['Hist'] = df['MACD'] - df['Signal']
-    
     df = df.iloc[-ndays:]
 
+    # 장기간 차트는 주봉으로 다운샘플링 (캔들 개수 5배 절감)
+    if ndays > 200:
+        agg = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last'}
+        if 'Volume' in df.columns:
+            agg['Volume'] = 'sum'
+        for col in ('MA5', 'MA10', 'MA20', 'MA30', 'BB_Upper', 'BB_Lower', 'RSI', 'MACD', 'Signal', 'Hist'):
+            agg[col] = 'last'
+        df = df.resample('W').agg(agg).dropna(subset=['Open'])
+
     # --- [동적 패널 구성] ---
-    apds = []
-    # 패널 번호 관리 (0: 메인, 1: 거래량(고정))
-    current_panel = 2 if volume else 1 
-    ratios = [6] # 메인 차트 비율
-    if volume: ratios.append(2) # 거래량 패널 비율
+    # 패널 비율 (메인 6 : 보조 2), 행 개수는 토글에 따라 결정
+    ratios = [6]
+    if volume: ratios.append(2)
+    if show_rsi: ratios.append(2)
+    if show_macd: ratios.append(2)
+    n_rows = len(ratios)
+
+    # plotly-resampler: 지표 트레이스를 LTTB로 다운샘플링해 전송량 절감
+    fig = FigureResampler(make_subplots(
+        rows=n_rows, cols=1, shared_xaxes=True, vertical_spacing=0.03,
+        row_heights=[r / sum(ratios) for r in ratios],
+    ))
 
-    # 볼린저 밴드 (메인 패널 0에 추가)
+    # 메인 패널: 캔들 + 이동평균선 (상승=빨강, 하락=파랑)
+    fig.add_trace(go.Candlestick(
+        x=df.index, open=df['Open'], high=df['High'], low=df['Low'], close=df['Close'],
+        increasing_line_color='red', decreasing_line_color='blue', name=code,
+    ), row=1, col=1)
+    for window, color in ((5, 'red'), (10, 'green'), (30, 'blue')):
+        fig.add_trace(go.Scatter(x=df.index, y=df[f'MA{window}'],
+                                 line=dict(color=color, width=1), name=f'MA{window}'), row=1, col=1)
+
+    # 볼린저 밴드 (메인 패널에 추가)
     if show_bb:
-        apds.append(mpf.make_addplot(df['BB_Upper'], color='silver', width=0.7, alpha=0.5))
-        apds.append(mpf.make_addplot(df['BB_Lower'], color='silver', width=0.7, alpha=0.5))
+        for band in ('BB_Upper', 'BB_Lower'):
+            fig.add_trace(go.Scatter(x=df.index, y=df[band],
+                                     line=dict(color='silver', width=0.7), opacity=0.5, name=band), row=1, col=1)
+
+    current_row = 2
+    if volume:
+        fig.add_trace(go.Bar(x=df.index, y=df['Volume'], marker_color='gray', name='Volume'),
+                      row=current_row, col=1)
+        current_row += 1
 
     # RSI (동적 패널 할당)
     if show_rsi:
-        apds.append(mpf.make_addplot(df['RSI'], panel=current_panel, color='orange', ylabel='RSI'))
-        ratios.append(2)
-        current_panel += 1
+        fig.add_trace(go.Scatter(x=df.index, y=df['RSI'], line=dict(color='orange'), name='RSI'),
+                      row=current_row, col=1)
+        fig.update_yaxes(title_text='RSI', row=current_row, col=1)
+        current_row += 1
 
     # MACD (동적 패널 할당)
     if show_macd:
-        apds.append(mpf.make_addplot(df['MACD'], panel=current_panel, color='fuchsia', ylabel='MACD'))
-        apds.append(mpf.make_addplot(df['Signal'], panel=current_panel, color='blue'))
-        apds.append(mpf.make_addplot(df['Hist'], panel=current_panel, type='bar', color='gray', alpha=0.3))
-        ratios.append(2)
-
-    marketcolors = mpf.make_marketcolors(up='red', down='blue', edge='black', wick={'up':'red', 'down':'blue'}, volume='inherit')
-    mpf_style = mpf.make_mpf_style(base_mpf_style=chart_style, marketcolors=marketcolors)
-
-    # 차트 그리기
-    fig, axlist = mpf.plot(
-        df, type='candle', volume=volume, addplot=apds,
-        style=mpf_style, figsize=(14, 8 + (len(ratios)*2)), # 패널 개수에 따라 높이 자동 조절
-        panel_ratios=tuple(ratios), # 계산된 비율 적용
-        mav=(5, 10, 30), mavcolors=('red', 'green', 'blue'),
-        returnfig=True
+        fig.add_trace(go.Scatter(x=df.index, y=df['MACD'], line=dict(color='fuchsia'), name='MACD'),
+                      row=current_row, col=1)
+        fig.add_trace(go.Scatter(x=df.index, y=df['Signal'], line=dict(color='blue'), name='Signal'),
+                      row=current_row, col=1)
+        fig.add_trace(go.Bar(x=df.index, y=df['Hist'], marker_color='gray', opacity=0.3, name='Hist'),
+                      row=current_row, col=1)
+        fig.update_yaxes(title_text='MACD', row=current_row, col=1)
+
+    fig.update_layout(
+        template=PLOTLY_TEMPLATES.get(chart_style, 'plotly'),
+        height=300 + n_rows * 200, # 패널 개수에 따라 높이 자동 조절
+        xaxis_rangeslider_visible=False,
+        showlegend=False,
     )
-    
-    st.session_state.plt_fig = fig
+
+    # plotly Figure는 JSON 트레이스라 세션에 그대로 보관해도 가볍다
+    st.session_state.chart_fig = fig
+    st.session_state.render_key = render_key
 
 # 🔥 클릭 가능한 주식 목록
 def create_clickable_dataframe(df):
@@ -151,37 +298,45 @@ def create_clickable_dataframe(df):
     
     st.markdown("**📈 종목 클릭**")
     
-    df_display = df.head(100).reset_index(drop=True)
-    
-    # 고정된 높이(예: 400px)의 스크롤 컨테이너 생성
-    with st.container(height=400):
-        for idx, row in df_display.iterrows():
-            col1, col2, col3, col4, col5 = st.columns([1.5, 1.5, 2.5, 2, 1])
-            
-            with col1:
-                if st.button(f"📈 {row['Code']}", key=f"btn_code_{idx}", use_container_width=True):
-                    st.session_state.code_index = str(row['Code'])
-                    st.session_state.auto_chart_trigger = True
-                    st.session_state.plt_fig = None 
-                    st.session_state.df_title = ""
-                    st.session_state.df_date = ""
-                    st.rerun()
-            
-            with col2:
-                st.markdown(f"**{row.get('Name', 'N/A')}**")
-            
-            with col3:
-                close_price = row.get('Close')
-                if pd.notna(close_price):
-                    st.write(f"현재가: {close_price:,.0f}") # metric 대신 가벼운 텍스트 권장
-                
-            with col4:
-                marcap = row.get('Marcap')
-                if pd.notna(marcap):
-                    st.caption(f"시총: {marcap:,.0f}")
-            
-            with col5:
-                st.caption(row.get('Market', 'N/A'))
+    # 한 번에 20행만 렌더링 (페이지 단위 지연 렌더링)
+    page_size = 20
+    n_pages = max(1, (len(df) + page_size - 1) // page_size)
+    page = st.number_input('페이지', min_value=1, max_value=n_pages, value=1, step=1, key='symbol_page')
+    df_display = df.iloc[(page - 1) * page_size:page * page_size].reset_index(drop=True)
+    show_cols = [c for c in ('Code', 'Name', 'Close', 'Marcap', 'Market') if c in df_display.columns]
+
+    # 행별 버튼 500개 대신 단일 st.dataframe 컴포넌트 (가상화 렌더링)
+    event = st.dataframe(
+        df_display[show_cols],
+        on_select="rerun",
+        selection_mode="single-row",
+        use_container_width=True,
+        height=400,
+        hide_index=True,
+        column_config={
+            'Code': st.column_config.TextColumn('종목코드'),
+            'Name': st.column_config.TextColumn('종목명'),
+            'Close': st.column_config.NumberColumn('현재가', format='%.0f'),
+            'Marcap': st.column_config.NumberColumn('시총', format='%.0f'),
+            'Market': st.column_config.TextColumn('시장'),
+        },
+        key='symbol_table',
+    )
+
+    rows = event.selection.rows
+    if rows:
+        selected_code = str(df_display['Code'].iloc[rows[0]])
+        # 선택이 유지된 채 rerun될 때 중복 트리거 방지
+        if selected_code != st.session_state.get('last_selected_code'):
+            st.session_state.last_selected_code = selected_code
+            st.session_state.code_index = selected_code
+            st.session_state.auto_chart_trigger = True
+            st.session_state.chart_fig = None
+            st.session_state.df_title = ""
+            st.session_state.df_date = ""
+    else:
+        # 선택 해제 시 가드 초기화 → 같은 행을 다시 클릭하면 차트가 재트리거됨
+        st.session_state.pop('last_selected_code', None)
         
 
 # 초기화
@@ -202,8 +357,8 @@ if 'chart_style' not in st.session_state:
     st.session_state.chart_style = 'default'
 if 'volume' not in st.session_state:
     st.session_state.volume = True
-if 'plt_fig' not in st.session_state:
-    st.session_state.plt_fig = None
+if 'chart_fig' not in st.session_state:
+    st.session_state.chart_fig = None
 if 'auto_chart_trigger' not in st.session_state:
     st.session_state.auto_chart_trigger = False
 
@@ -230,12 +385,14 @@ with st.form(key='get_list'):
 
 if submit_button:
     with st.spinner('주식 목록을 가져오는 중...'):
-        df = get_symbols(market=market, sort=sort)
+        df = get_symbols(market=market)
         if df is not None:
             st.session_state.show_list = True
-            if sort in df.columns:
-                df = df.sort_values(by=sort, ascending=st.session_state.ascending)
+            actual_sort = sort if sort in df.columns else 'Code'
+            df = df.sort_values(by=actual_sort, ascending=st.session_state.ascending)
             st.session_state.df_result = df
+            if 'Code' in df.columns:
+                prefetch_charts(df)
 
 # 🔥 클릭 가능한 목록 (목록 모드에서만)
 if st.session_state.show_list and st.session_state.df_result is not None:
@@ -248,8 +405,8 @@ with st.form(key='get_chart'):
     col1, col2, col3= st.columns([1, 2, 1])
     
     with col1:
-        ndays = st.number_input('과거 N일', min_value=10, max_value=365, 
-                              value=st.session_state.ndays, step=10)
+        ndays = st.number_input('과거 N일', min_value=10, max_value=365,
+                              step=10, key='ndays')
     
     with col2:
         code_input = st.text_input(
@@ -277,19 +434,17 @@ if (chart_submit and code_input.strip()) or st.session_state.auto_chart_trigger:
     
     # 트리거 초기화 (무한 루프 방지)
     st.session_state.auto_chart_trigger = False
-    
-    # 1. 기존 차트 삭제 (새 종목을 위해)
-    st.session_state.plt_fig = None
-    
-    # 2. 차트 새로 생성 (chart 함수 내부에서 plt_fig, df_title 등을 세션에 저장함)
+
+    # 차트 생성 — 설정이 안 바뀌었으면 chart()가 캐시된 plotly Figure를 그대로 재사용
+    # (chart 함수 내부에서 chart_fig, df_title 등을 세션에 저장함)
     with st.spinner('차트 생성 중...'):
         chart(current_code, ndays, chart_style, volume, show_bb, show_rsi, show_macd)
     st.rerun()
     
 
 # 🎯 최종 차트 출력 (세션에 그림이 있다면 어디서든 항상 표시)
-if st.session_state.plt_fig is not None:
+if st.session_state.chart_fig is not None:
     st.markdown(st.session_state.df_title, unsafe_allow_html=True)
     st.markdown(st.session_state.df_date, unsafe_allow_html=True)
-    st.pyplot(st.session_state.plt_fig)
+    st.plotly_chart(st.session_state.chart_fig, use_container_width=True)
     
\ No newline at end of file